@@ -10,33 +10,34 @@ secondary bucket to copy files locally as needed.
 @rauthur
 """
 import argparse
-import csv
-import gzip
-import random
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from functools import cache
 from typing import Optional
 
-import boto3
-
 from ccget.aws import (
     S3StorageClass,
+    account_id,
     bucket_arn,
+    client,
     create_job_manifest_on_s3,
     get_role_arn,
     manifest_arn,
-    object_etag,
 )
-from ccget.consts import AWS_REGION, CC_BUCKET, account_id
-from ccget.paths import warc_paths_local_fn
-from ccget.shards import list_shards
+from ccget.consts import AWS_REGION, CC_BUCKET
+from ccget.shards import list_shards, read_manifest_keys, read_warc_paths
+
+_MAX_WORKERS = 32
 
 
-@dataclass
+@dataclass(frozen=True)
 class Config:
     shard_id: Optional[str]
     n: int
     cache_dir: str
     dest_bucket_name: str
+    dest_bucket_arn: str
     manifest_prefix: str
     manifest_file: Optional[str]
     reports_prefix: str
@@ -46,7 +47,7 @@ class Config:
 
 
 def _verify_bucket_region(bucket: str) -> None:
-    s3 = boto3.client("s3")
+    s3 = client("s3")
     res = s3.get_bucket_location(Bucket=bucket)
 
     # us-east-1 is None for LocationConstraint!!!
@@ -86,28 +87,31 @@ def _verify_shard_or_manifest_file(shard: str, manifest_file: str):
         raise RuntimeError("Specify either shard OR manifest file")
 
 
+@cache
+def _all_shard_ids() -> frozenset[str]:
+    return frozenset(s.id for s in list_shards())
+
+
 def _verify_shard(shard: str, cache_dir: Optional[str]):
     if shard is None:
         return
 
-    all_shards = set([s.id for s in list_shards()])
-
-    if shard not in all_shards:
+    if shard not in _all_shard_ids():
         raise RuntimeError(f"Unknown shard: {shard}")
 
     if cache_dir is None:
         raise RuntimeError("Must provide --cache-dir when specifying shard")
 
 
-def _create_batch_job(s3_manifest_key: str, config: Config) -> str:
-    s3control = boto3.client("s3control", region_name=AWS_REGION)
+def _create_batch_job(s3_manifest_key: str, etag: str, config: Config) -> str:
+    s3control = client("s3control")
 
     response = s3control.create_job(
         AccountId=account_id(),
         ConfirmationRequired=True,
         Operation={
             "S3PutObjectCopy": {
-                "TargetResource": bucket_arn(config.dest_bucket_name),
+                "TargetResource": config.dest_bucket_arn,
                 "MetadataDirective": "REPLACE",
                 "NewObjectMetadata": {"RequesterCharged": False},
                 "NewObjectTagging": [],
@@ -118,7 +122,7 @@ def _create_batch_job(s3_manifest_key: str, config: Config) -> str:
             }
         },
         Report={
-            "Bucket": bucket_arn(config.dest_bucket_name),
+            "Bucket": config.dest_bucket_arn,
             "Format": "Report_CSV_20180820",
             "Enabled": True,
             "Prefix": config.reports_prefix,
@@ -131,44 +135,80 @@ def _create_batch_job(s3_manifest_key: str, config: Config) -> str:
             },
             "Location": {
                 "ObjectArn": manifest_arn(s3_manifest_key, config.dest_bucket_name),
-                "ETag": object_etag(config.dest_bucket_name, s3_manifest_key),
+                "ETag": etag,
             },
         },
         Priority=10,  # Higher is more urgent
         RoleArn=config.role_arn,
     )
 
-    print("Created Batch Copy JobId: ", response["JobId"])
-
     return response["JobId"]
 
 
-def main(config: Config):
+def _submit_job(config: Config) -> tuple[str, str]:
+    """Uploads the manifest and creates the batch job. Returns the manifest key and
+    the JobId."""
     if config.manifest_file:
-        with open(config.manifest_file, newline="") as c:
-            reader = csv.reader(c)
-            keys = [r[1] for r in reader]
+        keys = read_manifest_keys(config.manifest_file, config.n)
     else:
-        with gzip.open(warc_paths_local_fn(config.shard_id, config.cache_dir)) as f:
-            keys = [k for k in f.read().decode("utf-8").splitlines()]
-
-    if config.n > 0 and config.n < len(keys):
-        # Here we will set a seed that is not shared with other RNG states to allow the
-        # job suffix to be different while the sampled files are the same
-        rng = random.Random(102)
-        keys = rng.sample(keys, config.n)
+        keys = read_warc_paths(config.shard_id, config.cache_dir, config.n)
 
-    s3_manifest_key = create_job_manifest_on_s3(
+    s3_manifest_key, etag = create_job_manifest_on_s3(
         keys,
         config.manifest_prefix,
         CC_BUCKET,
         config.dest_bucket_name,
     )
-    print(f"Created manifest: s3://{config.dest_bucket_name}/{s3_manifest_key}")
 
-    _create_batch_job(s3_manifest_key, config)
+    return s3_manifest_key, _create_batch_job(s3_manifest_key, etag, config)
+
+
+def main(config: Config) -> str:
+    s3_manifest_key, job_id = _submit_job(config)
+
+    print(f"Created manifest: s3://{config.dest_bucket_name}/{s3_manifest_key}")
+    print("Created Batch Copy JobId: ", job_id)
     print("Please confirm and start the job from the AWS S3 console")
 
+    return job_id
+
+
+def main_many(configs: list[Config]) -> bool:
+    """Runs the copy for many shards concurrently. Each job is dominated by S3 request
+    latency so threads sharing the same clients overlap well. A failing shard does not
+    stop the others; one line is printed per shard and False is returned if any
+    failed."""
+    # Fill the cache once instead of racing to do so from every worker
+    account_id()
+
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=min(_MAX_WORKERS, len(configs))) as ex:
+        futures = {ex.submit(_submit_job, config): config for config in configs}
+
+        for future in as_completed(futures):
+            config = futures[future]
+
+            try:
+                s3_manifest_key, job_id = future.result()
+            except Exception as ex:
+                failed.append(config.shard_id)
+                print(f"{config.shard_id}: FAILED {type(ex).__name__}: {ex}")
+                continue
+
+            print(
+                f"{config.shard_id}: JobId {job_id}"
+                f" (manifest s3://{config.dest_bucket_name}/{s3_manifest_key})"
+            )
+
+    if len(failed) < len(configs):
+        print("Please confirm and start the jobs from the AWS S3 console")
+
+    if failed:
+        print(f"Failed shards: {' '.join(failed)}")
+
+    return not failed
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -177,7 +217,8 @@ if __name__ == "__main__":
         "--shard",
         type=str,
         required=False,
-        help="The shard to archive",
+        nargs="+",
+        help="The shard(s) to archive. Multiple shards are submitted concurrently.",
     )
     parser.add_argument(
         "-n",
@@ -248,19 +289,30 @@ if __name__ == "__main__":
     _verify_deep_archive_when_all(args.n, args.storage_class, args.ignore_checks)
     _verify_deep_archive_when_many(args.n, args.storage_class, args.ignore_checks)
     _verify_shard_or_manifest_file(args.shard, args.manifest_file)
-    _verify_shard(args.shard, args.cache_dir)
-
-    config = Config(
-        shard_id=args.shard,
-        n=args.n,
-        cache_dir=args.cache_dir,
-        dest_bucket_name=args.bucket,
-        manifest_prefix=args.manifest_prefix,
-        manifest_file=args.manifest_file,
-        reports_prefix=args.reports_prefix,
-        role_arn=get_role_arn(args.role_name),
-        storage_class=S3StorageClass[args.storage_class],
-        ignore_checks=args.ignore_checks,
-    )
 
-    main(config)
+    for shard in args.shard or []:
+        _verify_shard(shard, args.cache_dir)
+
+    role_arn = get_role_arn(args.role_name)
+    configs = [
+        Config(
+            shard_id=shard,
+            n=args.n,
+            cache_dir=args.cache_dir,
+            dest_bucket_name=args.bucket,
+            dest_bucket_arn=bucket_arn(args.bucket),
+            manifest_prefix=args.manifest_prefix,
+            manifest_file=args.manifest_file,
+            reports_prefix=args.reports_prefix,
+            role_arn=role_arn,
+            storage_class=S3StorageClass[args.storage_class],
+            ignore_checks=args.ignore_checks,
+        )
+        for shard in args.shard or [None]
+    ]
+
+    if len(configs) > 1:
+        if not main_many(configs):
+            sys.exit(1)
+    else:
+        main(configs[0])
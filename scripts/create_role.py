@@ -14,12 +14,13 @@ are re-used as well.
 
 import argparse
 import json
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
-import boto3
 from botocore.exceptions import ClientError
 
-from ccget.consts import CC_BUCKET, account_id
+from ccget.aws import account_id, client
+from ccget.consts import CC_BUCKET
 
 _ASSUME_ROLE = json.dumps(
     {
@@ -133,30 +134,42 @@ def _get_or_create_role(iam, role_name: str) -> dict:
 
 
 def main(config: Config):
-    iam = boto3.client("iam")
-
-    put_objects_policy = _get_or_create_managed_policy(
-        iam,
-        _PUT_OBJECTS_ROLE_NAME,
-        _put_objects_policy_document(config.dest_bucket_name),
-    )
-
-    restore_objects_policy = _get_or_create_managed_policy(
-        iam,
-        _RESTORE_OBJECTS_ROLE_NAME,
-        _restore_objects_policy_document(config.dest_bucket_name),
-    )
-
-    role = _get_or_create_role(iam, config.role_name)
-
-    iam.attach_role_policy(
-        RoleName=config.role_name,
-        PolicyArn=put_objects_policy["Policy"]["Arn"],
-    )
-    iam.attach_role_policy(
-        RoleName=config.role_name,
-        PolicyArn=restore_objects_policy["Policy"]["Arn"],
-    )
+    iam = client("iam")
+
+    # Policy ARNs need the account id; resolve it before any worker does
+    account_id()
+
+    # The policies and the role are independent so look them up (or create them) in
+    # parallel; IAM clients are thread-safe
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        put_objects_policy = ex.submit(
+            _get_or_create_managed_policy,
+            iam,
+            _PUT_OBJECTS_ROLE_NAME,
+            _put_objects_policy_document(config.dest_bucket_name),
+        )
+
+        restore_objects_policy = ex.submit(
+            _get_or_create_managed_policy,
+            iam,
+            _RESTORE_OBJECTS_ROLE_NAME,
+            _restore_objects_policy_document(config.dest_bucket_name),
+        )
+
+        role = ex.submit(_get_or_create_role, iam, config.role_name).result()
+
+        policy_arns = [
+            put_objects_policy.result()["Policy"]["Arn"],
+            restore_objects_policy.result()["Policy"]["Arn"],
+        ]
+
+        attachments = [
+            ex.submit(iam.attach_role_policy, RoleName=config.role_name, PolicyArn=arn)
+            for arn in policy_arns
+        ]
+
+        for attachment in attachments:
+            attachment.result()
 
     print(f"Role ARN: {role['Role']['Arn']}")
 
@@ -7,12 +7,17 @@ warc.paths.gz files are small (< 200KB) and give S3 keys for all WARC files in a
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Optional
 
-import boto3
-
-from ccget.shards import fetch_warc_paths, list_shards, replicate_warc_paths
+from ccget.aws import client
+from ccget.shards import (
+    fetch_warc_paths,
+    list_replicated_keys,
+    list_shards,
+    replicate_warc_paths,
+)
 
 
 @dataclass
@@ -21,15 +26,27 @@ class Config:
     cache_dir: Optional[str]
     ignore_cache: bool
     dest_bucket: str
+    concurrency: int
+
+
+def _verify_concurrency(concurrency: int):
+    if concurrency < 1:
+        raise RuntimeError(f"--concurrency must be at least 1, got {concurrency}")
 
 
-def process_shard(s3, shard_id: str, config: Config):
+def process_shard(
+    s3,
+    shard_id: str,
+    config: Config,
+    replicated_keys: Optional[dict[str, int]] = None,
+):
     # First check if already replicated and copy if not
     replicate_warc_paths(
         s3,
         shard_id=shard_id,
         dest_bucket_name=config.dest_bucket,
         ignore_cache=config.ignore_cache,
+        replicated_keys=replicated_keys,
     )
 
     # We only download if a local cache dir is specified
@@ -45,10 +62,23 @@ def process_shard(s3, shard_id: str, config: Config):
 
 
 def main(config: Config) -> None:
-    s3 = boto3.resource("s3")
+    # Clients (unlike resources) are safe to share between threads
+    s3 = client("s3")
+
+    # One listing of the destination bucket replaces a HEAD request per shard
+    replicated_keys = None
+    if not config.ignore_cache:
+        replicated_keys = list_replicated_keys(s3, config.dest_bucket)
+
+    # Each shard is a couple of small S3 requests so overlap their latency
+    with ThreadPoolExecutor(max_workers=config.concurrency) as ex:
+        futures = [
+            ex.submit(process_shard, s3, shard_id, config, replicated_keys)
+            for shard_id in config.shard_ids
+        ]
 
-    for shard_id in config.shard_ids:
-        process_shard(s3, shard_id, config)
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":
@@ -78,8 +108,18 @@ if __name__ == "__main__":
         default=False,
         help="Overwrite any existing files on S3 and local cache",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        required=False,
+        default=20,
+        help="Number of shards to replicate at the same time",
+    )
 
     args = parser.parse_args()
+
+    _verify_concurrency(args.concurrency)
+
     shard_ids = args.shards
 
     if not shard_ids:
@@ -90,6 +130,7 @@ if __name__ == "__main__":
         cache_dir=args.cache_dir,
         ignore_cache=args.ignore_cache,
         dest_bucket=args.bucket,
+        concurrency=args.concurrency,
     )
 
     main(config)
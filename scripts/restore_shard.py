@@ -4,25 +4,20 @@ Restore a shard to active S3 storage (standard tier) for a fixed number of days.
 @rauthur
 """
 import argparse
-import csv
-import gzip
-import random
 from dataclasses import dataclass
+from functools import cache
 from math import ceil
 from typing import Optional
 
-import boto3
-
 from ccget.aws import (
+    account_id,
     bucket_arn,
+    client,
     create_job_manifest_on_s3,
     get_role_arn,
     manifest_arn,
-    object_etag,
 )
-from ccget.consts import AWS_REGION, account_id
-from ccget.paths import warc_paths_local_fn
-from ccget.shards import list_shards
+from ccget.shards import list_shards, read_manifest_keys, read_warc_paths
 
 
 @dataclass
@@ -31,6 +26,7 @@ class Config:
     n: int
     cache_dir: str
     dest_bucket_name: str
+    dest_bucket_arn: str
     manifest_prefix: str
     manifest_file: Optional[str]
     reports_prefix: str
@@ -38,8 +34,8 @@ class Config:
     role_arn: str
 
 
-def _create_batch_job(s3_manifest_key: str, config: Config) -> str:
-    s3control = boto3.client("s3control", region_name=AWS_REGION)
+def _create_batch_job(s3_manifest_key: str, etag: str, config: Config) -> str:
+    s3control = client("s3control")
 
     response = s3control.create_job(
         AccountId=account_id(),
@@ -51,7 +47,7 @@ def _create_batch_job(s3_manifest_key: str, config: Config) -> str:
             },
         },
         Report={
-            "Bucket": bucket_arn(config.dest_bucket_name),
+            "Bucket": config.dest_bucket_arn,
             "Format": "Report_CSV_20180820",
             "Enabled": True,
             "Prefix": config.reports_prefix,
@@ -64,7 +60,7 @@ def _create_batch_job(s3_manifest_key: str, config: Config) -> str:
             },
             "Location": {
                 "ObjectArn": manifest_arn(s3_manifest_key, config.dest_bucket_name),
-                "ETag": object_etag(config.dest_bucket_name, s3_manifest_key),
+                "ETag": etag,
             },
         },
         Priority=10,  # Higher is more urgent
@@ -98,35 +94,29 @@ def _verify_shard_or_manifest_file(shard: str, manifest_file: str):
         raise RuntimeError("Specify either shard OR manifest file")
 
 
+@cache
+def _all_shard_ids() -> frozenset[str]:
+    return frozenset(s.id for s in list_shards())
+
+
 def _verify_shard(shard: str):
     if shard is None:
         return
 
-    all_shards = set([s.id for s in list_shards()])
-
-    if shard not in all_shards:
+    if shard not in _all_shard_ids():
         raise RuntimeError(f"Unknown shard: {shard}")
 
 
 def main(config: Config):
     if config.manifest_file:
-        with open(config.manifest_file, newline="") as c:
-            reader = csv.reader(c)
-            keys = [r[1] for r in reader]
+        keys = read_manifest_keys(config.manifest_file, config.n)
     else:
-        with gzip.open(warc_paths_local_fn(config.shard_id, config.cache_dir)) as f:
-            keys = [k for k in f.read().decode("utf-8").splitlines()]
-
-    if config.n > 0 and config.n < len(keys):
-        # Here we will set a seed that is not shared with other RNG states to allow the
-        # job suffix to be different while the sampled files are the same
-        rng = random.Random(102)
-        keys = rng.sample(keys, config.n)
+        keys = read_warc_paths(config.shard_id, config.cache_dir, config.n)
 
     cost_estimate = _restore_estimate(len(keys), config)
     print(f"\nThis restore job is estimated to cost ${cost_estimate:.2f}")
 
-    s3_manifest_key = create_job_manifest_on_s3(
+    s3_manifest_key, etag = create_job_manifest_on_s3(
         keys,
         config.manifest_prefix,
         config.dest_bucket_name,
@@ -134,7 +124,7 @@ def main(config: Config):
     )
     print(f"Created manifest: s3://{config.dest_bucket_name}/{s3_manifest_key}")
 
-    _create_batch_job(s3_manifest_key, config)
+    _create_batch_job(s3_manifest_key, etag, config)
     print("Please confirm and start the job from the AWS S3 console")
 
 
@@ -202,17 +192,26 @@ if __name__ == "__main__":
         required=True,
         help="Role name for the batch job execution role",
     )
+    parser.add_argument(
+        "--skip-shard-check",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Do not check the shard against the list of known shards",
+    )
 
     args = parser.parse_args()
 
     _verify_shard_or_manifest_file(args.shard, args.manifest_file)
-    _verify_shard(args.shard)
+
+    if not args.skip_shard_check:
+        _verify_shard(args.shard)
 
     config = Config(
         shard_id=args.shard,
         n=args.n,
         cache_dir=args.cache_dir,
         dest_bucket_name=args.bucket,
+        dest_bucket_arn=bucket_arn(args.bucket),
         manifest_prefix=args.manifest_prefix,
         manifest_file=args.manifest_file,
         reports_prefix=args.reports_prefix,
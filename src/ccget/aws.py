@@ -1,13 +1,25 @@
 import csv
+import io
 import os
-import random
-import string
-import tempfile
+import threading
 from enum import Enum
+from functools import cache
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 
-from ccget.consts import AWS_REGION
+from ccget.consts import AWS_REGION, BOTO_CONFIG
+
+_SESSION = boto3.session.Session(region_name=AWS_REGION)
+_SESSION_LOCK = threading.Lock()
+
+# Bounded so large uploads do not take over the shared connection pool
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
 
 
 class S3StorageClass(Enum):
@@ -20,8 +32,22 @@ class S3StorageClass(Enum):
     GLACIER_IR = 7
 
 
+@cache
+def client(service: str):
+    """Shared client per service so connections are kept alive between calls. Clients
+    are thread-safe but creating them from a session is not."""
+    with _SESSION_LOCK:
+        return _SESSION.client(service, config=BOTO_CONFIG)
+
+
+@cache
+def account_id() -> str:
+    return client("sts").get_caller_identity()["Account"]
+
+
 def job_suffix() -> str:
-    return "".join(random.choices(string.ascii_lowercase, k=8))
+    # 10 lowercase hex characters, safe in S3 keys
+    return os.urandom(5).hex()
 
 
 def manifest_arn(s3_manifest_key: str, bucket_name: str) -> str:
@@ -33,37 +59,53 @@ def bucket_arn(bucket_name: str) -> str:
 
 
 def object_etag(bucket: str, key: str) -> str:
-    s3 = boto3.client("s3")
+    s3 = client("s3")
     return s3.head_object(Bucket=bucket, Key=key)["ETag"]
 
 
+@cache
 def get_role_arn(role_name: str) -> str:
-    iam = boto3.client("iam")
+    iam = client("iam")
     res = iam.get_role(RoleName=role_name)
 
     return res["Role"]["Arn"]
 
 
+def _manifest_csv(keys: list[str], bucket_name: str) -> bytes:
+    # Common Crawl keys never need quoting so skip the csv module unless one does
+    if any("," in key or '"' in key for key in keys):
+        buf = io.StringIO()
+        csv.writer(buf).writerows((bucket_name, key) for key in keys)
+        return buf.getvalue().encode("utf-8")
+
+    return "".join(f"{bucket_name},{key}\n" for key in keys).encode("utf-8")
+
+
 def create_job_manifest_on_s3(
     keys: list[str],
     manifest_prefix: str,
     source_bucket_name: str,
     dest_bucket_name: str,
-) -> str:
-    s3 = boto3.client("s3", region_name=AWS_REGION)
-
-    # We'll write the S3 expected format manifest file here
-    with tempfile.TemporaryDirectory() as tmpdir:
-        manifest_fn = f"manifest-{job_suffix()}.csv"
-        s3_manifest_key = f"{manifest_prefix}/{manifest_fn}"
-        manifest_fullpath = os.path.join(tmpdir, manifest_fn)
-
-        with open(manifest_fullpath, "w", encoding="utf-8", newline="") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=["bucket", "key"])
-            writer.writerows(
-                [{"bucket": source_bucket_name, "key": key} for key in keys]
-            )
-
-        s3.upload_file(manifest_fullpath, dest_bucket_name, s3_manifest_key)
-
-        return s3_manifest_key
+) -> tuple[str, str]:
+    """Uploads the manifest and returns its key along with the ETag required to
+    reference it from a batch job."""
+    s3 = client("s3")
+
+    # Build the S3 expected format manifest in memory; small ones (all shards so far)
+    # are uploaded in a single request
+    s3_manifest_key = f"{manifest_prefix}/manifest-{job_suffix()}.csv"
+    body = _manifest_csv(keys, source_bucket_name)
+
+    if len(body) < _TRANSFER_CONFIG.multipart_threshold:
+        res = s3.put_object(Bucket=dest_bucket_name, Key=s3_manifest_key, Body=body)
+        return s3_manifest_key, res["ETag"]
+
+    # upload_fileobj does not return the (multipart) ETag so it must be looked up
+    s3.upload_fileobj(
+        io.BytesIO(body),
+        dest_bucket_name,
+        s3_manifest_key,
+        Config=_TRANSFER_CONFIG,
+    )
+
+    return s3_manifest_key, object_etag(dest_bucket_name, s3_manifest_key)
@@ -1,12 +1,19 @@
-from functools import cache
-
-import boto3
+from botocore.config import Config
 
 CC_BUCKET = "commoncrawl"
 AWS_REGION = "us-east-1"
 
+# Shared by all clients; the default pool of 10 connections is easily exhausted
+BOTO_CONFIG = Config(
+    max_pool_connections=64,
+    retries={"max_attempts": 10, "mode": "adaptive"},
+    tcp_keepalive=True,
+)
+
 
-@cache
 def account_id() -> str:
-    client = boto3.client("sts")
-    return client.get_caller_identity()["Account"]
+    """Kept for backwards compatibility, see ccget.aws.account_id"""
+    # Imported here since ccget.aws depends on this module
+    from ccget.aws import account_id as _account_id
+
+    return _account_id()
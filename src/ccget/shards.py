@@ -3,18 +3,42 @@ Work with specific CC shard files for replication and fetching.
 
 @rauthur
 """
+import csv
+import io
 import json
 import logging
 import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager, suppress
 from dataclasses import dataclass
+from functools import cache
+from typing import IO, AnyStr, Iterable, Iterator, Optional
 
 import botocore.exceptions
 import requests
+from boto3.s3.transfer import TransferConfig
 
 from ccget.consts import CC_BUCKET
 from ccget.paths import warc_paths_local_fn, warc_paths_s3_key
 
+try:
+    # ISA-L's SIMD inflate is a drop-in replacement and considerably faster
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
 _URL = "https://index.commoncrawl.org/collinfo.json"
+_COLLINFO_CACHE_FN = os.path.join(tempfile.gettempdir(), "ccget_collinfo.json")
+_COLLINFO_TTL = 24 * 60 * 60
+_READ_BUFFER_SIZE = 256 * 1024
+
+# warc.paths.gz files are < 200KB so skip the transfer manager's thread pool
+_SMALL_FILE_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    use_threads=False,
+)
 
 
 @dataclass
@@ -23,41 +47,115 @@ class ShardInfo:
     name: str
 
 
+def _fetch_collinfo() -> list[dict]:
+    """Fetches the Common Crawl index listing. A copy is kept on disk and reused for
+    CCGET_SHARDS_TTL seconds (defaults to a day) since new crawls are monthly."""
+    ttl = int(os.environ.get("CCGET_SHARDS_TTL", _COLLINFO_TTL))
+
+    try:
+        if time.time() - os.path.getmtime(_COLLINFO_CACHE_FN) < ttl:
+            with open(_COLLINFO_CACHE_FN) as f:
+                shards = json.load(f)
+
+            if isinstance(shards, list):
+                return shards
+    except (OSError, ValueError):
+        pass
+
+    res = requests.get(_URL)
+    res.raise_for_status()
+    shards = res.json()
+
+    if not isinstance(shards, list):
+        raise RuntimeError(f"Unexpected response from {_URL}: {shards}")
+
+    # Write then rename so concurrent runs never read a partial file. Caching is best
+    # effort; a read-only tmpdir should not fail a successful fetch
+    tmp_fn = f"{_COLLINFO_CACHE_FN}.{os.getpid()}"
+    try:
+        with open(tmp_fn, "w") as f:
+            json.dump(shards, f)
+        os.replace(tmp_fn, _COLLINFO_CACHE_FN)
+    except OSError as ex:
+        logging.warning(f"Could not cache shard list to {_COLLINFO_CACHE_FN}: {ex}")
+
+        with suppress(OSError):
+            os.remove(tmp_fn)
+
+    return shards
+
+
+@cache
 def list_shards(use_cache=True) -> list[ShardInfo]:
     if use_cache:
         with open(os.path.join("resources", "shards.json")) as f:
             shards = json.loads(f.read())
     else:
-        res = requests.get(_URL)
-        shards = res.json()
+        shards = _fetch_collinfo()
 
     return [ShardInfo(id=s["id"], name=s["name"]) for s in shards]
 
 
+def _s3_client(s3):
+    """Accepts either an S3 client or an S3 resource (as these helpers used to take)
+    and returns the client. Resources expose theirs as meta.client."""
+    return getattr(getattr(s3, "meta", None), "client", s3)
+
+
 def warc_paths_is_replicated(
     s3,
     shard_id: str,
     dest_bucket_name: str,
     max_bytes: int = 1_000_000,
+    known_keys: Optional[dict[str, int]] = None,
 ) -> bool:
-    client = s3.meta.client
+    s3 = _s3_client(s3)
+    key = warc_paths_s3_key(shard_id)
 
-    try:
-        key = warc_paths_s3_key(shard_id)
-        res = client.head_object(Bucket=dest_bucket_name, Key=key)
+    if known_keys is not None:
+        # Answer from a prior listing (see list_replicated_keys) without a HEAD request
+        if key not in known_keys:
+            return False
+
+        size = known_keys[key]
+    else:
+        try:
+            res = s3.head_object(Bucket=dest_bucket_name, Key=key)
+        except botocore.exceptions.ClientError as ex:
+            if ex.response["Error"]["Code"] == "404":
+                return False
+            else:
+                raise ex
 
-        # Ensure body size not too large
         size = res["ContentLength"]
 
-        if size > max_bytes:
-            raise RuntimeError(f"Unexpectedly large warc.paths.gz: {shard_id}: {size}")
+    # Ensure body size not too large
+    if size > max_bytes:
+        raise RuntimeError(f"Unexpectedly large warc.paths.gz: {shard_id}: {size}")
 
-        return True
-    except botocore.exceptions.ClientError as ex:
-        if ex.response["Error"]["Code"] == "404":
-            return False
-        else:
-            raise ex
+    return True
+
+
+def list_replicated_keys(s3, dest_bucket_name: str) -> dict[str, int]:
+    """Lists shard-level keys (such as warc.paths.gz) in the destination bucket with a
+    single paginated scan instead of one HEAD request per shard. Returns sizes by key.
+    Archived WARC files under each shard's segments/ prefix are rolled up by the
+    delimiter so only a few keys per shard are returned.
+
+    Args:
+        s3: S3 client (or resource) from boto3
+        dest_bucket_name (str): Bucket that warc.paths.gz files are replicated to
+    """
+    paginator = _s3_client(s3).get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=dest_bucket_name,
+        Prefix="crawl-data/CC-MAIN-",
+        Delimiter="/segments/",
+    )
+
+    return {
+        obj["Key"]: obj["Size"] for page in pages for obj in page.get("Contents", [])
+    }
 
 
 def replicate_warc_paths(
@@ -65,29 +163,35 @@ def replicate_warc_paths(
     shard_id: str,
     dest_bucket_name: str,
     ignore_cache=False,
+    replicated_keys: Optional[dict[str, int]] = None,
 ) -> None:
     """Replicates a warc.paths.gz file from Common Crawl to an intermediary bucket.
     The key is copied over in the same pattern as the Common Crawl structure.
 
     Args:
-        s3: s3 Resource from boto3
+        s3: S3 client (or resource) from boto3
         shard_id (str): The shard to replicate
         dest_bucket_name (str): Where to store the warc.paths.gz file
         ignore_cache (bool): If True then always replication. Defaults to False.
+        replicated_keys (dict[str, int], optional): Result of list_replicated_keys. If
+            given it is checked instead of issuing a HEAD request. Defaults to None.
     """
-    if not ignore_cache and warc_paths_is_replicated(s3, shard_id, dest_bucket_name):
+    if not ignore_cache and warc_paths_is_replicated(
+        s3, shard_id, dest_bucket_name, known_keys=replicated_keys
+    ):
         print(f"Skipping S3 -> S3 replication for {shard_id}")
         return
 
-    dest_bucket = s3.Bucket(dest_bucket_name)
+    s3 = _s3_client(s3)
     obj_key = warc_paths_s3_key(shard_id)
 
     source_config = {"Bucket": CC_BUCKET, "Key": obj_key}
 
     try:
-        dest_bucket.copy(source_config, obj_key)
+        # Files are small so a single server-side copy beats the managed transfer
+        s3.copy_object(CopySource=source_config, Bucket=dest_bucket_name, Key=obj_key)
     except botocore.exceptions.ClientError as ex:
-        if ex.response["Error"]["Code"] == "404":
+        if ex.response["Error"]["Code"] in ("404", "NoSuchKey"):
             logging.warning(f"[replicate] warc.paths.gz not found for {shard_id}!")
         else:
             raise ex
@@ -104,7 +208,7 @@ def fetch_warc_paths(
     source and not directly from the Common Crawl bucket.
 
     Args:
-        s3: S3 resource client
+        s3: S3 client (or resource) from boto3
         shard_id (str): Shard ID to fetch
         cache_dir (str): Local cache directory
         ignore_cache (bool, optional): Overwrites files if True. Defaults to False.
@@ -126,10 +230,86 @@ def fetch_warc_paths(
     os.makedirs(os.path.dirname(out_fn), exist_ok=True)
 
     try:
-        bucket = s3.Bucket(bucket_name)
-        bucket.download_file(warc_paths_s3_key(shard_id), out_fn)
+        _s3_client(s3).download_file(
+            bucket_name,
+            warc_paths_s3_key(shard_id),
+            out_fn,
+            Config=_SMALL_FILE_TRANSFER_CONFIG,
+        )
     except botocore.exceptions.ClientError as ex:
         if ex.response["Error"]["Code"] == "404":
             logging.warning(f"[fetch] warc.paths.gz not found for {shard_id}!")
         else:
             raise ex
+
+
+@contextmanager
+def open_warc_paths(shard_id: str, cache_dir: str) -> Iterator[IO[bytes]]:
+    """Opens a local warc.paths.gz file for streaming its raw (ASCII) lines.
+
+    Args:
+        shard_id (str): Shard ID to read
+        cache_dir (str): Local cache directory used by fetch_warc_paths
+    """
+    fn = warc_paths_local_fn(shard_id=shard_id, cache_dir=cache_dir)
+
+    # Feed zlib large chunks rather than many small default-sized reads
+    with open(fn, "rb", buffering=0) as raw, io.BufferedReader(
+        raw, buffer_size=_READ_BUFFER_SIZE
+    ) as buf, gzip.GzipFile(fileobj=buf) as gz:
+        yield gz
+
+
+def sample_keys(keys: Iterable[AnyStr], n: int) -> list[AnyStr]:
+    """Returns all keys when `n` is 0 (or negative) or not smaller than the number of
+    keys. Otherwise `n` keys are randomly sampled with a fixed seed so copy and restore
+    jobs over the same shard select the same keys. The selection must not change or
+    restores would no longer match previously archived samples.
+
+    Args:
+        keys (Iterable): Keys to sample
+        n (int): Number of keys to keep (0 or less for all)
+    """
+    keys = list(keys)
+
+    if 0 < n < len(keys):
+        # Here we will set a seed that is not shared with other RNG states to allow the
+        # job suffix to be different while the sampled files are the same
+        rng = random.Random(102)
+        keys = rng.sample(keys, n)
+
+    return keys
+
+
+def _manifest_key(line: str) -> str:
+    # Rows are plain bucket,key pairs so a split is enough unless the row is quoted
+    if '"' in line:
+        return next(csv.reader([line]))[1]
+
+    return line.rstrip("\r\n").split(",", 1)[1]
+
+
+def read_manifest_keys(manifest_file: str, n: int) -> list[str]:
+    """Reads keys from a local bucket,key CSV manifest (no header).
+
+    Args:
+        manifest_file (str): Local manifest file
+        n (int): Number of keys to sample (0 for all), see sample_keys
+    """
+    with open(manifest_file, encoding="utf-8", newline="") as c:
+        return sample_keys((_manifest_key(line) for line in c), n)
+
+
+def read_warc_paths(shard_id: str, cache_dir: str, n: int) -> list[str]:
+    """Reads keys from a local warc.paths.gz file.
+
+    Args:
+        shard_id (str): Shard ID to read
+        cache_dir (str): Local cache directory used by fetch_warc_paths
+        n (int): Number of keys to sample (0 for all), see sample_keys
+    """
+    with open_warc_paths(shard_id, cache_dir) as f:
+        # Sample raw lines and only decode the keys that are kept
+        keys = sample_keys((line.rstrip(b"\n") for line in f), n)
+
+    return [k.decode("ascii") for k in keys]